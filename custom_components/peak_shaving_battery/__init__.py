@@ -1,15 +1,29 @@
 from __future__ import annotations
 
+import inspect
+from dataclasses import dataclass
 from datetime import timedelta
+from typing import Any, Dict, Final
 
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import HomeAssistant
 from homeassistant.helpers.typing import ConfigType
 
-from .const import DOMAIN, CONF_UPDATE_INTERVAL, DEFAULT_UPDATE_INTERVAL
+from .const import CONF_UPDATE_INTERVAL, DEFAULT_UPDATE_INTERVAL
 from .coordinator import PeakShavingBatteryCoordinator
 
-PLATFORMS = ["sensor"]
+PLATFORMS: Final[tuple[str, ...]] = ("sensor",)
+
+
+@dataclass(slots=True)
+class EntryRuntime:
+    """Per-entry state kept on ConfigEntry.runtime_data."""
+
+    coordinator: PeakShavingBatteryCoordinator
+    config: Dict[str, Any]
+
+
+PeakShavingConfigEntry = ConfigEntry[EntryRuntime]
 
 
 async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
@@ -17,22 +31,23 @@ async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
     return True
 
 
-async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
+async def async_setup_entry(hass: HomeAssistant, entry: PeakShavingConfigEntry) -> bool:
     """Set up from UI config entry."""
-    hass.data.setdefault(DOMAIN, {})
-
-    update_interval_sec = entry.options.get(
-        CONF_UPDATE_INTERVAL, entry.data.get(CONF_UPDATE_INTERVAL, DEFAULT_UPDATE_INTERVAL)
-    )
+    # Merged once here and cached; only rebuilt when the update listener fires.
+    merged = {**entry.data, **entry.options}
+    update_interval_sec = merged.get(CONF_UPDATE_INTERVAL, DEFAULT_UPDATE_INTERVAL)
 
     coordinator = PeakShavingBatteryCoordinator(
         hass=hass,
-        config={**entry.data, **entry.options},
-        update_interval=timedelta(seconds=int(update_interval_sec)),
+        config=merged,
+        update_interval=timedelta(seconds=update_interval_sec),
     )
     await coordinator.async_config_entry_first_refresh()
 
-    hass.data[DOMAIN][entry.entry_id] = {"coordinator": coordinator}
+    entry.runtime_data = EntryRuntime(
+        coordinator=coordinator,
+        config=merged,
+    )
 
     # Listen for options updates (e.g. verbose_logging toggle)
     entry.async_on_unload(entry.add_update_listener(_async_update_listener))
@@ -41,20 +56,40 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     return True
 
 
-async def _async_update_listener(hass: HomeAssistant, entry: ConfigEntry) -> None:
+async def _async_update_listener(hass: HomeAssistant, entry: PeakShavingConfigEntry) -> None:
     """Handle options update from UI."""
-    data = hass.data.get(DOMAIN, {}).get(entry.entry_id)
-    if not data:
+    runtime: EntryRuntime | None = getattr(entry, "runtime_data", None)
+    if runtime is None:
         return
 
-    coordinator: PeakShavingBatteryCoordinator = data["coordinator"]
-    coordinator.update_config({**entry.data, **entry.options})
-    await coordinator.async_request_refresh()
+    merged = {**entry.data, **entry.options}
+    if merged == runtime.config:
+        # Options saved without changes; don't trigger an extra run.
+        return
+    runtime.config = merged
+
+    coordinator = runtime.coordinator
+    coordinator.update_config(merged)
+    if not coordinator.has_listeners:
+        # No sensors subscribed (yet); the next scheduled run picks up the new config.
+        return
+
+    # Don't hold up the options flow "Submit" on a full coordinator run.
+    entry.async_create_background_task(
+        hass, coordinator.async_request_refresh(), "peak_shaving_battery options refresh"
+    )
+
+
+if __debug__:
+    # Must stay a plain module-level function: a bound method registered as update
+    # listener would keep its instance (and whatever it references) alive.
+    assert not inspect.ismethod(_async_update_listener)
 
 
-async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
+async def async_unload_entry(hass: HomeAssistant, entry: PeakShavingConfigEntry) -> bool:
     """Unload the config entry."""
     unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
     if unload_ok:
-        hass.data[DOMAIN].pop(entry.entry_id, None)
+        # HA drops runtime_data itself; just stop the refresh timer/debouncer.
+        await entry.runtime_data.coordinator.async_shutdown()
     return unload_ok
@@ -5,6 +5,8 @@
 
 from __future__ import annotations
 
+import sys
+
 DOMAIN = "peak_shaving_battery"
 
 # Inverter
@@ -36,10 +38,21 @@ CONF_NOTIFY_DEVICE = "notify_device"
 # Advanced
 CONF_VERBOSE = "verbose_logging"
 CONF_UPDATE_INTERVAL = "update_interval"
+CONF_UPDATE_INTERVAL_IDLE = "update_interval_idle"
 
-DEFAULT_UPDATE_INTERVAL = 5  # seconds
+DEFAULT_UPDATE_INTERVAL_ACTIVE = 5  # seconds
+DEFAULT_UPDATE_INTERVAL_IDLE = 30  # seconds, used while outputs are stable
+DEFAULT_UPDATE_INTERVAL = DEFAULT_UPDATE_INTERVAL_ACTIVE
+# Consecutive unchanged runs before switching to the idle interval
+IDLE_AFTER_STABLE_RUNS = 6
 DEFAULT_VERBOSE = True
 
+# Coordinator data keys (written by the coordinator, read by the sensors)
+ATTR_STATUS_STATE = sys.intern("status_state")
+ATTR_STATUS_ATTRS = sys.intern("status_attributes")
+ATTR_SOC_TARGET_STATE = sys.intern("lowest_min_state")
+ATTR_SOC_TARGET_ATTRS = sys.intern("lowest_min_attributes")
+
 # NEW defaults (match your existing hardcoded constants)
 DEFAULT_MAX_CHARGE_POWER_W = 5000
 DEFAULT_MAX_DISCHARGE_POWER_W = 4300
@@ -1,23 +1,23 @@
 from __future__ import annotations
 
-from typing import Any, Dict
+from functools import cached_property
 
 from homeassistant.components.sensor import SensorEntity
-from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 from homeassistant.helpers.update_coordinator import CoordinatorEntity
 
-from .const import DOMAIN
+from . import PeakShavingConfigEntry
+from .const import ATTR_SOC_TARGET_ATTRS, ATTR_SOC_TARGET_STATE, ATTR_STATUS_ATTRS, ATTR_STATUS_STATE
 from .coordinator import PeakShavingBatteryCoordinator
 
 
 async def async_setup_entry(
     hass: HomeAssistant,
-    entry: ConfigEntry,
+    entry: PeakShavingConfigEntry,
     async_add_entities: AddEntitiesCallback,
 ) -> None:
-    coordinator: PeakShavingBatteryCoordinator = hass.data[DOMAIN][entry.entry_id]["coordinator"]
+    coordinator = entry.runtime_data.coordinator
 
     async_add_entities(
         [
@@ -29,37 +29,47 @@ async def async_setup_entry(
 
 class BatteryManualStatusSensor(CoordinatorEntity[PeakShavingBatteryCoordinator], SensorEntity):
     _attr_has_entity_name = True
+    _attr_translation_key = "battery_manual_status"
 
-    def __init__(self, coordinator: PeakShavingBatteryCoordinator, entry: ConfigEntry) -> None:
+    def __init__(self, coordinator: PeakShavingBatteryCoordinator, entry: PeakShavingConfigEntry) -> None:
         super().__init__(coordinator)
-        self._attr_unique_id = f"{entry.entry_id}_battery_manual_status"
-        self._attr_name = "Battery Manual Status"
+        self._entry_id = entry.entry_id
+        self._update_attrs()
 
-    @property
-    def native_value(self) -> Any:
-        data = self.coordinator.data or {}
-        return data.get("status_state")
+    @cached_property
+    def unique_id(self) -> str:
+        return self._entry_id + "_battery_manual_status"
 
-    @property
-    def extra_state_attributes(self) -> Dict[str, Any]:
-        data = self.coordinator.data or {}
-        return data.get("status_attributes", {})
+    def _update_attrs(self) -> None:
+        data = self.coordinator.data
+        self._attr_native_value = data.get(ATTR_STATUS_STATE)
+        self._attr_extra_state_attributes = data.get(ATTR_STATUS_ATTRS)
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        self._update_attrs()
+        super()._handle_coordinator_update()
 
 
 class BatterySocTargetSensor(CoordinatorEntity[PeakShavingBatteryCoordinator], SensorEntity):
     _attr_has_entity_name = True
+    _attr_translation_key = "battery_soc_target"
 
-    def __init__(self, coordinator: PeakShavingBatteryCoordinator, entry: ConfigEntry) -> None:
+    def __init__(self, coordinator: PeakShavingBatteryCoordinator, entry: PeakShavingConfigEntry) -> None:
         super().__init__(coordinator)
-        self._attr_unique_id = f"{entry.entry_id}_battery_soc_target"
-        self._attr_name = "Battery SOC Target %"
-
-    @property
-    def native_value(self) -> Any:
-        data = self.coordinator.data or {}
-        return data.get("lowest_min_state")
-
-    @property
-    def extra_state_attributes(self) -> Dict[str, Any]:
-        data = self.coordinator.data or {}
-        return data.get("lowest_min_attributes", {})
+        self._entry_id = entry.entry_id
+        self._update_attrs()
+
+    @cached_property
+    def unique_id(self) -> str:
+        return self._entry_id + "_battery_soc_target"
+
+    def _update_attrs(self) -> None:
+        data = self.coordinator.data
+        self._attr_native_value = data.get(ATTR_SOC_TARGET_STATE)
+        self._attr_extra_state_attributes = data.get(ATTR_SOC_TARGET_ATTRS)
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        self._update_attrs()
+        super()._handle_coordinator_update()